@@ -8,7 +8,7 @@ def run_clean() -> Path:
     """
     Wrapper around scripts/cryptopay_clean_data.py
 
-    - Reads cryptopay_allData.json
+    - Reads cryptopay_allData.jsonl
     - If no cleaned file yet: clean_all() and delta = everything
     - Else: incremental_clean() and delta = only new records
     - Writes:
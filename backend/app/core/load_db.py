@@ -7,8 +7,10 @@ def run_load() -> None:
     """
     Wrapper around scripts/load_transactions.py
 
-    - Checks current Purchase row count.
+    - Checks whether the Purchase table has any rows.
     - If DB empty: loads full CLEAN_JSON_PATH.
     - Else: loads DELTA_JSON_PATH (if non-empty).
+    - Runs the whole load on one connection inside a single explicit
+      transaction (BEGIN IMMEDIATE ... COMMIT), rolled back if anything fails.
     """
     loader.main()
@@ -1,7 +1,10 @@
 # backend/app/db.py
 
+from contextlib import contextmanager
 from pathlib import Path
+import os
 import sqlite3
+import threading
 
 # Folder containing this file (backend/app)
 APP_DIR = Path(__file__).resolve().parent
@@ -12,27 +15,237 @@ DB_PATH = APP_DIR / "cryptopay.sqlite"
 # Your schema file (the one in your screenshot)
 SCHEMA_PATH = APP_DIR / "schema.sql"
 
+# Applied to every connection. The defaults (rollback journal, synchronous=FULL,
+# no mmap, ~2 MB cache) make both the loader's bulk inserts and the dashboard's
+# reads pay far more disk IO than they need to.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",        # readers don't block the loader (persists in the file)
+    "PRAGMA synchronous=NORMAL",      # safe with WAL, fsync only at checkpoints
+    "PRAGMA mmap_size=536870912",     # 512 MB memory-mapped reads
+    "PRAGMA cache_size=-40000",       # ~40 MB page cache (negative = KiB)
+    "PRAGMA temp_store=MEMORY",
+)
 
-def get_connection() -> sqlite3.Connection:
+# Extra PRAGMAs for loader connections (bulk inserts touch many more pages)
+SQLITE_LOADER_PRAGMAS = (
+    "PRAGMA cache_size=-65536",       # ~64 MB page cache
+)
+
+# Only for the first full load into an empty DB (loader_transaction(bulk=True)),
+# undone afterwards. No fsyncs at all: an OS crash mid-load can at worst
+# leave a file that has to be deleted and loaded again from the cleaned
+# history, which is exactly what that load does anyway. Must be set outside
+# a transaction. (journal_mode stays WAL so the dashboard can keep reading;
+# foreign_keys is never turned on, so there's nothing to switch off.)
+SQLITE_BULK_PRAGMAS = (
+    "PRAGMA synchronous=OFF",
+)
+
+# Undoes SQLITE_BULK_PRAGMAS (the values from SQLITE_PRAGMAS). Only these are
+# reset: re-running all of SQLITE_PRAGMAS would also shrink a loader
+# connection's cache back from SQLITE_LOADER_PRAGMAS.
+SQLITE_BULK_RESTORE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+)
+
+
+# Idle connections kept open per pool (extra ones are closed on release)
+POOL_MAX_SIZE = 4
+
+
+def _connect(path: Path, loader: bool) -> sqlite3.Connection:
     """
-    Open a connection to the SQLite DB.
+    Open a new connection to the SQLite DB at path.
     Row factory is set to sqlite3.Row so you can get dict-like rows later.
+    SQLITE_PRAGMAS are applied before the connection is handed out.
+
+    check_same_thread is off because a pooled connection may be reused from
+    another thread (e.g. the dashboard's Update Data worker); the pool hands
+    each connection to one user at a time.
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(path, detect_types=0, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    if loader:
+        conn.isolation_level = None
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    if loader:
+        for pragma in SQLITE_LOADER_PRAGMAS:
+            conn.execute(pragma)
     return conn
 
 
+def _file_id(path: Path) -> tuple[int, int] | None:
+    """(st_dev, st_ino) of the file at path, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class SQLiteConnectionPool:
+    """
+    Reuses open connections to one DB file, so short lookups (init_db, row
+    counts, MAX(transaction_id)) don't each pay for opening the file,
+    running the PRAGMAs and re-reading the schema.
+
+    Each connection remembers which file it opened. If the DB file is
+    deleted or replaced (e.g. removed from disk to reload everything while
+    the dashboard keeps running), idle connections to the old file are
+    closed instead of reused, so work lands in the new file.
+    """
+
+    def __init__(self, path: Path, loader: bool = False, max_size: int = POOL_MAX_SIZE):
+        self.path = path
+        self.loader = loader
+        self.max_size = max_size
+        # (connection, _file_id of the file it opened)
+        self._idle: list[tuple[sqlite3.Connection, tuple[int, int] | None]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Yield a connection; same commit/rollback behaviour as
+        `with sqlite3.connect(...) as conn`, but on exit the connection goes
+        back to the pool instead of being left open.
+        """
+        current = _file_id(self.path)
+        conn = None
+        stale = []
+        with self._lock:
+            while self._idle:
+                idle_conn, file_id = self._idle.pop()
+                if file_id is not None and file_id == current:
+                    conn = idle_conn
+                    break
+                stale.append(idle_conn)
+        for idle_conn in stale:
+            idle_conn.close()
+
+        if conn is None:
+            conn = _connect(self.path, self.loader)
+            # sqlite3.connect creates the file if it was missing
+            current = _file_id(self.path)
+
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn, current)
+
+    def release(self, conn: sqlite3.Connection, file_id: tuple[int, int] | None) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((conn, file_id))
+                return
+        conn.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+_pools: dict[tuple[Path, bool], SQLiteConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(loader: bool = False) -> SQLiteConnectionPool:
+    """The pool for the current DB_PATH (loader and plain connections are pooled separately)."""
+    key = (Path(DB_PATH), loader)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SQLiteConnectionPool(*key)
+        return pool
+
+
+def get_connection(loader: bool = False):
+    """
+    Borrow a pooled connection to the SQLite DB; use it as a context manager:
+
+        with get_connection() as conn:
+            ...
+
+    The block is committed on success and rolled back if it raises, then
+    the connection is returned to the pool.
+
+    loader=True is for bulk loads: the connection is put in autocommit mode
+    (isolation_level=None) so the sqlite3 module never issues its own implicit
+    BEGIN/COMMIT. The caller runs one explicit transaction instead:
+        conn.execute("BEGIN IMMEDIATE") ... conn.execute("COMMIT")
+    (see loader_transaction).
+    """
+    return get_pool(loader).acquire()
+
+
+# DB files init_db() has already run schema.sql on in this process
+_initialized: set[Path] = set()
+_init_lock = threading.Lock()
+
+
 def init_db() -> None:
     """
     Create tables if they don't exist, using schema.sql.
     Safe to call multiple times.
+
+    The schema only runs once per DB file and process (again if the file
+    has been deleted since); later calls return without reading schema.sql
+    or touching the DB. A pipeline run calls this from several steps.
+    """
+    path = Path(DB_PATH)
+    with _init_lock:
+        if path in _initialized:
+            if path.exists():
+                return
+            # Deleted since: drop every pooled connection to the old file, so
+            # the schema below creates and fills a new one
+            get_pool().close_all()
+            get_pool(loader=True).close_all()
+
+        schema_sql = SCHEMA_PATH.read_text(encoding="utf-8")
+
+        with get_connection() as conn:
+            conn.executescript(schema_sql)
+            conn.commit()
+        _initialized.add(path)
+
+
+@contextmanager
+def loader_transaction(bulk: bool = False):
     """
-    schema_sql = SCHEMA_PATH.read_text(encoding="utf-8")
+    Yield one loader connection for a whole bulk load, inside a single
+    BEGIN IMMEDIATE ... COMMIT (rolled back if the body raises).
+
+    init_db() runs first: executescript commits on its own, so it can't
+    run inside the transaction. IMMEDIATE takes the write lock up front
+    instead of failing half-way through the load.
 
-    with get_connection() as conn:
-        conn.executescript(schema_sql)
-        conn.commit()
+    bulk=True applies SQLITE_BULK_PRAGMAS around the transaction; only pass
+    it when the Purchase table is empty.
+    """
+    init_db()
+    with get_connection(loader=True) as conn:
+        if bulk:
+            for pragma in SQLITE_BULK_PRAGMAS:
+                conn.execute(pragma)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            if bulk:
+                # Back to the normal settings before the connection is pooled again
+                for pragma in SQLITE_BULK_RESTORE_PRAGMAS:
+                    conn.execute(pragma)
 
 
 if __name__ == "__main__":
@@ -1,18 +1,210 @@
 # backend/app/pipeline.py
 
+import contextvars
+import queue
+import sys
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
 from app.core.scrape_purchases import run_scrape
 from app.core.clean_data import run_clean
 from app.core.load_db import run_load
+from app.db import get_connection, init_db, loader_transaction
+from scripts import cryptopay_clean_data as cleaner
+from scripts import cryptopay_scrape_data as scraper
+from scripts import load_transactions as loader
+
+# End-of-stream marker passed through the stage queues
+_DONE = object()
+
+# One pipeline run at a time per process. The dashboard runs the pipeline
+# in-process, so two sessions (or a click after a rerun) could otherwise
+# start a second run while the first is still writing the same files.
+PIPELINE_LOCK = threading.Lock()
+
+# Where print() output of the current run goes (see capture_output)
+_output_sink: contextvars.ContextVar = contextvars.ContextVar("pipeline_output", default=None)
+_stdout_lock = threading.Lock()
+
+
+class _ContextStdout:
+    """
+    sys.stdout stand-in: writes go to the _output_sink of the writing context,
+    or to the original stream when there is none. Installed once and never
+    swapped back, so concurrent captures can't restore each other's streams.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        return (_output_sink.get() or self._stream).write(text)
+
+    def flush(self) -> None:
+        (_output_sink.get() or self._stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+@contextmanager
+def capture_output(sink):
+    """
+    Send print() output from this thread, and from the stage threads the
+    pipeline starts, to sink (anything with write/flush) for the duration of
+    the block. Other threads keep printing to the console, unlike
+    contextlib.redirect_stdout, which swaps sys.stdout for the whole process.
+    """
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ContextStdout):
+            sys.stdout = _ContextStdout(sys.stdout)
+    token = _output_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _output_sink.reset(token)
+
+
+def stores_in_sync(existing_entries: list[dict]) -> bool:
+    """
+    True when the raw file, the cleaned history and the DB all end at the same
+    newest transaction_id.
+
+    The streaming pipeline only handles rows scraped in the current run, so it
+    needs nothing to be left over from an earlier run (first run, or a run
+    that failed half-way). Those cases go through the sequential steps.
+    """
+    if not existing_entries or not cleaner.CLEAN_JSON_PATH.exists():
+        return False
+
+    latest_raw = (existing_entries[0].get("transaction_id") or "").strip()
+    latest_cleaned = cleaner.load_latest_cleaned_txid()
+    if latest_cleaned is None or latest_raw != str(latest_cleaned):
+        return False
+
+    init_db()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM Purchase WHERE transaction_id = ?", (latest_cleaned,)
+        ).fetchone()
+    return row is not None
+
+
+def run_streaming_pipeline(existing_entries: list[dict]) -> None:
+    """
+    Scrape, clean and load at the same time instead of one after another:
+
+      scraper thread --raw batches--> cleaner thread --cleaned batches--> loader (this thread)
+
+    Cleaning and inserting start on the first scraped page while later pages
+    are still loading in the browser. All inserts share one transaction.
+    The raw and cleaned files are written and the transaction committed only
+    once every stage has finished without errors.
+
+    If a stage fails, the others are told to stop (after the page they are
+    on) and joined before the error is raised, so no thread outlives the run.
+    """
+    raw_q: queue.Queue = queue.Queue()
+    clean_q: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    errors: list[BaseException] = []
+    new_entries: list[dict] = []
+    new_cleaned: list[dict] = []
+
+    def scrape_worker():
+        try:
+            for batch in scraper.iter_new_entries(existing_entries):
+                new_entries.extend(batch)
+                raw_q.put(batch)
+                if stop.is_set():
+                    # Leaving the loop closes the generator and the browser
+                    return
+            print(f"Scraped {len(new_entries)} new entries.")
+        except BaseException as exc:
+            errors.append(exc)
+        finally:
+            raw_q.put(_DONE)
+
+    def clean_worker():
+        seen_txids: set[int] = set()
+        try:
+            with cleaner.open_txid_index() as known_txids:
+                while (batch := raw_q.get()) is not _DONE:
+                    if stop.is_set():
+                        continue  # drain until the scraper is done
+                    cleaned = []
+                    for raw in batch:
+                        txid = int(raw["transaction_id"])
+                        # Same safety net as incremental_clean
+                        if txid in seen_txids or cleaner.txid_in_index(known_txids, txid):
+                            continue
+                        seen_txids.add(txid)
+                        cleaned.append(cleaner.clean_record(raw))
+
+                    new_cleaned.extend(cleaned)
+                    clean_q.put(cleaned)
+        except BaseException as exc:
+            errors.append(exc)
+        finally:
+            clean_q.put(_DONE)
+
+    # Each stage runs in a copy of this context, so capture_output follows it
+    threads = [
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(scrape_worker,), name="scrape", daemon=True
+        ),
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(clean_worker,), name="clean", daemon=True
+        ),
+    ]
+    for t in threads:
+        t.start()
+
+    with loader_transaction() as conn:
+        try:
+            while (cleaned := clean_q.get()) is not _DONE:
+                if cleaned:
+                    loader.insert_all(cleaned, conn)
+        finally:
+            # A no-op once both stages are done; after a failed insert it
+            # stops them before the error leaves this function
+            stop.set()
+            for t in threads:
+                t.join()
+        if errors:
+            raise errors[0]
+
+        if new_entries:
+            scraper.append_entries(new_entries)
+        if new_cleaned:
+            cleaner.save_new_cleaned(new_cleaned)
+        else:
+            print("No new records to clean.")
+            cleaner.write_json(cleaner.DELTA_JSON_PATH, [])
+
+    print(f"Loaded {len(new_cleaned)} new purchases into SQLite.")
 
 
 def run_full_pipeline() -> None:
     """
-    1) Scrape (Playwright with saved state) → cryptopay_allData.json
-    2) Clean raw JSON → cryptopay_cleaned.json + cryptopay_cleaned_delta.json
+    1) Scrape (Playwright with saved state) → cryptopay_allData.jsonl (appended)
+    2) Clean raw JSON → cryptopay_cleaned.ndjson (appended) + cryptopay_cleaned_delta.json
     3) Load cleaned data into SQLite (full or delta)
+
+    When all three stores are already caught up (the usual incremental run),
+    the steps overlap via run_streaming_pipeline; otherwise they run in order.
     """
+    # Only the tail of the raw history is parsed: stores_in_sync needs the
+    # newest entry, and the streaming scrape (whose boundary is that entry)
+    # checks duplicates against at most KNOWN_TXIDS_WINDOW entries
+    existing_entries = scraper.load_recent_entries(None)
+    if stores_in_sync(existing_entries):
+        print("Data files and DB are in sync – streaming scrape → clean → load...")
+        run_streaming_pipeline(existing_entries)
+        print("✅ Pipeline completed successfully!")
+        return
+
     print("Step 1/3: Scraping purchases...")
     raw_path: Path = run_scrape()
     print(f"Raw data saved to: {raw_path}")
@@ -24,3 +24,10 @@ CREATE TABLE IF NOT EXISTS WashBayPurchase (
     wash_purchase_total      NUMERIC(4, 2) NOT NULL,     -- per-wash dollar amount
     FOREIGN KEY (transaction_id) REFERENCES Purchase(transaction_id)
 );
+
+-- Indexes for the dashboard's per-date queries (all filter on purchase_date
+-- and join the child tables on transaction_id).
+-- Covering: the grand/wash/vac totals query is answered from the index alone.
+CREATE INDEX IF NOT EXISTS idx_purchase_date_type ON Purchase(purchase_date, purchase_type, total_amount);
+CREATE INDEX IF NOT EXISTS idx_washbay_txid ON WashBayPurchase(transaction_id, bay_number, wash_purchase_total);
+-- VacuumPurchase needs none: transaction_id is its INTEGER PRIMARY KEY (the rowid).
@@ -1,5 +1,9 @@
+import io
 import sqlite3
 import subprocess
+import sys
+import threading
+import traceback
 from datetime import date, datetime
 from pathlib import Path
 
@@ -12,6 +16,13 @@ import streamlit as st
 BASE_DIR = Path(__file__).resolve().parents[1]          # backend/
 DB_PATH = BASE_DIR / "app" / "cryptopay.sqlite"
 
+# `streamlit run dashboard/app.py` only puts dashboard/ on sys.path;
+# backend/ is needed to import app.db and the pipeline in-process
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from app.db import SQLITE_PRAGMAS
+
 st.set_page_config(
     page_title="Carwash Control Panel",
     layout="wide",
@@ -53,20 +64,87 @@ left_col, right_col = st.columns([1, 3])
 def get_connection() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    # Same PRAGMAs as the pipeline's connections (WAL, relaxed sync, mmap, bigger page cache)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
+@st.cache_data(ttl=10, show_spinner=False)
 def get_last_update_time() -> str:
-    """Last modified time of the SQLite DB file."""
+    """
+    Last modified time of the SQLite DB (re-stat'd at most every 10s, not per rerun).
+
+    In WAL mode a commit only touches cryptopay.sqlite-wal; the main file
+    changes at the next checkpoint, which can be much later while
+    connections stay open. So the newer of the two mtimes is used.
+    """
     try:
         mtime = DB_PATH.stat().st_mtime
     except FileNotFoundError:
         return "No database file found"
+    try:
+        mtime = max(mtime, DB_PATH.with_name(DB_PATH.name + "-wal").stat().st_mtime)
+    except FileNotFoundError:
+        pass  # no WAL file (yet, or removed when the last connection closed)
     dt_obj = datetime.fromtimestamp(mtime)
     return dt_obj.strftime("%Y-%m-%d %I:%M %p")
 
 
-@st.cache_data(show_spinner=False)
+# One round-trip for everything get_daily_metrics needs. `target` resolves to
+# :target if that date has purchases, else the latest purchase_date (NULL if
+# the table is empty). Each result row is tagged:
+#   ('totals', date,          grand_total, wash_total, vac_total)
+#   ('bay',    bay_number,    total,       NULL,       NULL)
+#   ('vac',    vacuum_number, total,       NULL,       NULL)
+DAILY_METRICS_SQL = """
+WITH target AS (
+    SELECT COALESCE(
+        (SELECT purchase_date FROM Purchase WHERE purchase_date = :target LIMIT 1),
+        (SELECT MAX(purchase_date) FROM Purchase)
+    ) AS d
+)
+SELECT
+    'totals' AS tag,
+    t.d AS key,
+    COALESCE(SUM(p.total_amount), 0.0) AS total,
+    COALESCE(SUM(CASE WHEN p.purchase_type = 'W' THEN p.total_amount ELSE 0 END), 0.0) AS wash_total,
+    COALESCE(SUM(CASE WHEN p.purchase_type = 'V' THEN p.total_amount ELSE 0 END), 0.0) AS vac_total
+FROM target t
+LEFT JOIN Purchase p ON p.purchase_date = t.d
+
+UNION ALL
+
+SELECT
+    'bay',
+    w.bay_number,
+    COALESCE(SUM(w.wash_purchase_total), 0.0),
+    NULL,
+    NULL
+FROM WashBayPurchase w
+JOIN Purchase p ON p.transaction_id = w.transaction_id
+WHERE p.purchase_date = (SELECT d FROM target)
+GROUP BY w.bay_number
+
+UNION ALL
+
+SELECT
+    'vac',
+    v.vacuum_number,
+    COALESCE(SUM(p.total_amount), 0.0),
+    NULL,
+    NULL
+FROM VacuumPurchase v
+JOIN Purchase p ON p.transaction_id = v.transaction_id
+WHERE p.purchase_date = (SELECT d FROM target)
+  AND p.purchase_type = 'V'
+GROUP BY v.vacuum_number
+"""
+
+
+# Bounded + expiring: a dashboard left open for days neither grows the cache
+# forever nor keeps serving metrics from before an outside pipeline run.
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
 def get_daily_metrics(target: date):
     """
     Compute daily metrics using SQL:
@@ -76,90 +154,33 @@ def get_daily_metrics(target: date):
       - bay_totals: per-bay totals from WashBayPurchase
       - vacuum_totals: per-vac totals from VacuumPurchase
     Falls back to latest date in DB if target has no data.
+    All of it comes from a single DAILY_METRICS_SQL query.
     """
     conn = get_connection()
-    cur = conn.cursor()
+    rows = conn.execute(DAILY_METRICS_SQL, {"target": target.isoformat()}).fetchall()
 
-    # If target date has no data, fallback to latest purchase_date
+    # Defaults cover the "no data at all" case (target resolves to NULL)
     target_str = target.isoformat()
-
-    cur.execute(
-        "SELECT COUNT(*) AS c FROM Purchase WHERE purchase_date = ?;",
-        (target_str,),
-    )
-    row = cur.fetchone()
-    if row["c"] == 0:
-        cur.execute("SELECT MAX(purchase_date) AS max_d FROM Purchase;")
-        row2 = cur.fetchone()
-        if not row2 or row2["max_d"] is None:
-            # No data at all
-            return {
-                "date": target_str,
-                "wash_plus_vac": 0.0,
-                "wash_total": 0.0,
-                "vac_total": 0.0,
-                "bay_totals": {i: 0.0 for i in range(1, 8)},
-                "vacuum_totals": {i: 0.0 for i in range(1, 7)},
-            }
-        target_str = row2["max_d"]
-
-    # Grand + wash + vac totals from Purchase (Purchase.purchase_type ∈ {'W', 'V'})
-    cur.execute(
-        """
-        SELECT
-            COALESCE(SUM(total_amount), 0.0) AS grand_total,
-            COALESCE(SUM(CASE WHEN purchase_type = 'W' THEN total_amount ELSE 0 END), 0.0) AS wash_total,
-            COALESCE(SUM(CASE WHEN purchase_type = 'V' THEN total_amount ELSE 0 END), 0.0) AS vac_total
-        FROM Purchase
-        WHERE purchase_date = ?
-        """,
-        (target_str,),
-    )
-    row = cur.fetchone()
-    grand_total = float(row["grand_total"])
-    wash_total = float(row["wash_total"])
-    vac_total = float(row["vac_total"])
-
-    # Per-bay totals derived from WashBayPurchase rows
-    cur.execute(
-        """
-        SELECT
-            w.bay_number AS bay_number,
-            COALESCE(SUM(w.wash_purchase_total), 0.0) AS total
-        FROM WashBayPurchase w
-        JOIN Purchase p ON p.transaction_id = w.transaction_id
-        WHERE p.purchase_date = ?
-        GROUP BY w.bay_number
-        """,
-        (target_str,),
-    )
-    bay_rows = cur.fetchall()
-    bay_totals = {i: 0.0 for i in range(1, 8)}
-    for r in bay_rows:
-        bay_num = r["bay_number"]
-        if bay_num in bay_totals:
-            bay_totals[bay_num] = float(r["total"])
-
-    # Per-vac totals derived from VacuumPurchase rows
-    cur.execute(
-        """
-        SELECT
-            v.vacuum_number AS vacuum_number,
-            COALESCE(SUM(p.total_amount), 0.0) AS total
-        FROM VacuumPurchase v
-        JOIN Purchase p ON p.transaction_id = v.transaction_id
-        WHERE p.purchase_date = ?
-          AND p.purchase_type = 'V'
-        GROUP BY v.vacuum_number
-        """,
-        (target_str,),
-    )
-    vac_rows = cur.fetchall()
-    vacuum_totals = {i: 0.0 for i in range(1, 7)}
-    for r in vac_rows:
-        vac_num = r["vacuum_number"]
-        if vac_num in vacuum_totals:
-            vacuum_totals[vac_num] = float(r["total"])
+    grand_total = wash_total = vac_total = 0.0
+    bay_rows: dict[int, float] = {}
+    vac_rows: dict[int, float] = {}
+
+    for r in rows:
+        tag = r["tag"]
+        if tag == "totals":
+            if r["key"] is not None:
+                target_str = r["key"]
+            grand_total = float(r["total"])
+            wash_total = float(r["wash_total"])
+            vac_total = float(r["vac_total"])
+        elif tag == "bay":
+            bay_rows[r["key"]] = float(r["total"])
+        elif tag == "vac":
+            vac_rows[r["key"]] = float(r["total"])
+
+    # SQL already aggregated per bay/vac; fill in zeros for idle ones
+    bay_totals = {i: bay_rows.get(i, 0.0) for i in range(1, 8)}
+    vacuum_totals = {i: vac_rows.get(i, 0.0) for i in range(1, 7)}
 
     return {
         "date": target_str,
@@ -202,25 +223,52 @@ with left_col:
     st.write("")
 
     if st.button("Update Data"):
-        with st.spinner("Running ETL pipeline (python -m app.pipeline)..."):
-            result = subprocess.run(
-                ["python", "-m", "app.pipeline"],
-                cwd=BASE_DIR,
-                capture_output=True,
-                text=True,
-            )
-
-        if result.returncode == 0:
-            st.success("Data updated successfully ✅")
-            # Clear cached metrics so they recompute from updated DB
-            get_daily_metrics.clear()
-            if result.stdout:
-                with st.expander("Show pipeline output"):
-                    st.code(result.stdout)
+        # Imported on first click (pandas/Playwright are slow to import), then
+        # reused: no new interpreter + re-import per click like `python -m app.pipeline`
+        from app.pipeline import PIPELINE_LOCK, capture_output, run_full_pipeline
+
+        pipeline_output = io.StringIO()
+        pipeline_errors: list[BaseException] = []
+
+        def run_pipeline():
+            # Only this run's prints land in pipeline_output (see capture_output)
+            try:
+                with capture_output(pipeline_output):
+                    run_full_pipeline()
+            except Exception as exc:
+                pipeline_errors.append(exc)
+                pipeline_output.write("\n" + traceback.format_exc())
+            finally:
+                PIPELINE_LOCK.release()
+
+        # Held until the worker finishes, even if this script run is interrupted
+        # by a rerun, so a second click can't start a run next to it
+        if not PIPELINE_LOCK.acquire(blocking=False):
+            st.warning("A data update is already running – try again once it has finished.")
         else:
-            st.error("Data update FAILED ❌")
-            with st.expander("Show error output"):
-                st.code(result.stderr or result.stdout)
+            with st.spinner("Running ETL pipeline (app.pipeline.run_full_pipeline)..."):
+                live_log = st.empty()
+                worker = threading.Thread(target=run_pipeline, daemon=True)
+                worker.start()
+                # Stream the pipeline's prints while it runs
+                while worker.is_alive():
+                    worker.join(timeout=0.5)
+                    live_log.code(pipeline_output.getvalue() or "Starting pipeline...")
+                live_log.empty()
+
+            output = pipeline_output.getvalue()
+            if not pipeline_errors:
+                st.success("Data updated successfully ✅")
+                # Clear cached metrics so they recompute from updated DB
+                get_daily_metrics.clear()
+                get_last_update_time.clear()
+                if output:
+                    with st.expander("Show pipeline output"):
+                        st.code(output)
+            else:
+                st.error("Data update FAILED ❌")
+                with st.expander("Show error output"):
+                    st.code(output)
 
 
 # ---------------------------------------------------------
@@ -1,17 +1,41 @@
 # backend/scripts/cryptopay_clean_data.py
 
-import json
+import mmap
+import multiprocessing
+import os
 import re
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import chain
 from pathlib import Path
 
+import orjson
+import pandas as pd
+
 # --- Paths ---
 
 BASE_DIR = Path(__file__).resolve().parents[1]   # backend/
 DATA_DIR = BASE_DIR / "data"
-RAW_JSON_PATH = DATA_DIR / "cryptopay_allData.json"
-CLEAN_JSON_PATH = DATA_DIR / "cryptopay_cleaned.json"
+RAW_JSON_PATH = DATA_DIR / "cryptopay_allData.jsonl"  # raw history, one entry per line, oldest -> newest
+CLEAN_JSON_PATH = DATA_DIR / "cryptopay_cleaned.ndjson"  # full history, one record per line, oldest -> newest
+LEGACY_CLEAN_JSON_PATH = DATA_DIR / "cryptopay_cleaned.json"  # pre-NDJSON history (JSON list, newest -> oldest)
 DELTA_JSON_PATH = DATA_DIR / "cryptopay_cleaned_delta.json"  # <-- NEW
+LATEST_TXID_PATH = DATA_DIR / "cryptopay_cleaned_latest_txid.txt"  # newest cleaned txid
+TXIDS_INDEX_PATH = DATA_DIR / "cryptopay_cleaned_txids.bin"  # sorted int64 txids of the history
+
+# --- Regexes (compiled once, used for every record) ---
+
+_VAC_NUM_RE = re.compile(r"vacuum[^0-9]*([0-9]+)", re.IGNORECASE)
+_BAY_NUM_RE = re.compile(r"bay[^0-9]*([0-9]+)", re.IGNORECASE)
+
+# Deletes '$' and ',' from money strings in one C-level pass
+_MONEY_TRANS = str.maketrans("", "", "$,")
+
+# Below this many raw records, starting worker processes costs more than it saves
+PARALLEL_CLEAN_MIN_RECORDS = 2000
 
 
 # --- Helper functions (cleaning only) ---
@@ -31,10 +55,10 @@ def parse_cardholder(cardholder: str) -> tuple[str, str]:
     Assumes format: 'NAME (1234)' -> ('NAME', '1234')
     Keeps last4 as a string to preserve leading zeros (e.g. '0420').
     """
-    name_part, last4_part = cardholder.split("(", 1)
-    cardholder_name = name_part.strip()
-    cardholder_last4 = last4_part.strip().strip(")")
-    return cardholder_name, cardholder_last4
+    name_part, sep, last4_part = cardholder.partition("(")
+    if not sep:
+        raise ValueError(f"Unexpected cardholder format: {cardholder!r}")
+    return name_part.strip(), last4_part.rstrip(") ").lstrip()
 
 
 def parse_money(money_str: str) -> float:
@@ -43,10 +67,11 @@ def parse_money(money_str: str) -> float:
     '$3,200.75' -> 3200.75
 
     Returned as float suitable for NUMERIC(4,2)-style storage in SQLite.
+    Amounts always carry 2 decimals, and float() of such a string is already
+    the closest double, so no round() is needed (float() also ignores
+    surrounding whitespace).
     """
-    cleaned = money_str.replace("$", "").replace(",", "").strip()
-    value = float(cleaned)
-    return round(value, 2)
+    return float(money_str.translate(_MONEY_TRANS))
 
 
 def parse_details_text(details_text: str) -> dict:
@@ -56,39 +81,39 @@ def parse_details_text(details_text: str) -> dict:
       - purchase_type = 'V', vacuum_number
       - purchase_type = 'W', wash_bay_purchases (list of bay_number + wash_purchase_total)
     """
-    lines = [line.strip() for line in details_text.splitlines() if line.strip()]
-
-    vac_lines = [ln for ln in lines if ln.startswith("Vac")]
-    bay_lines = [ln for ln in lines if ln.startswith("Wash Bay")]
-
-    # Vacuum purchase
-    if vac_lines:
-        # Example: 'Vac\t(vacuum 3)\t$1.50'
-        line = vac_lines[0]
-        parts = [p for p in line.split("\t") if p.strip()]
-
-        # e.g. '(vacuum 3)'
-        vacuum_part = next(p for p in parts if "vacuum" in p.lower())
-        vacuum_number = int(re.search(r"(\d+)", vacuum_part).group(1))
+    # Single pass over the lines: a Vac line decides the type right away,
+    # Wash Bay lines are only collected here and parsed below.
+    bay_lines: list[str] = []
+
+    for raw_line in details_text.splitlines():
+        line = raw_line.strip()
+
+        # Vacuum purchase
+        if line.startswith("Vac"):
+            # Example: 'Vac\t(vacuum 3)\t$1.50'
+            # Get vacuum_number from the whole line (e.g. '(vacuum 3)')
+            vacuum_number = int(_VAC_NUM_RE.search(line).group(1))
+
+            return {
+                "purchase_type": "V",
+                "vacuum_number": vacuum_number,
+            }
 
-        return {
-            "purchase_type": "V",
-            "vacuum_number": vacuum_number,
-        }
+        if line.startswith("Wash Bay"):
+            bay_lines.append(line)
 
     # Wash Bay purchase (can be 1 or more lines)
     wash_bay_purchases: list[dict] = []
 
     for line in bay_lines:
         # Example: 'Wash Bay\t(bay 5)\t$3.75'
-        parts = [p for p in line.split("\t") if p.strip()]
-
         # 1) Get bay_number from the whole line
-        m = re.search(r"bay[^0-9]*([0-9]+)", line, re.IGNORECASE)
+        m = _BAY_NUM_RE.search(line)
         bay_number = int(m.group(1))
 
-        # 2) Get the money part from the split pieces
-        total_part = next(p for p in parts if "$" in p)
+        # 2) The money part is always the last tab-separated field
+        #    (lines are already stripped, so it is never empty)
+        total_part = line.rsplit("\t", 1)[-1]
         wash_purchase_total = parse_money(total_part)
 
         wash_bay_purchases.append(
@@ -123,7 +148,7 @@ def compute_total_amount(raw_total_str: str, details: dict) -> float:
 
 def clean_record(raw: dict) -> dict:
     """
-    Take one raw JSON entry from cryptopay_allData.json and
+    Take one raw JSON entry from cryptopay_allData.jsonl and
     return a normalized dict ready for DB loading, with names
     aligned to the schema.
     """
@@ -156,20 +181,226 @@ def clean_record(raw: dict) -> dict:
     }
 
 
+def clean_all_vectorized(raw_records: list[dict]) -> list[dict]:
+    """
+    Batch version of [clean_record(r) for r in raw_records].
+
+    Datetimes and vacuum totals are parsed column-wise with pandas.
+    details_text is still parsed per row, since the number of Wash Bay lines
+    varies between receipts, and so is the cardholder: parse_cardholder's
+    exact rules (ValueError without "(", empty last4 for "NAME ()") have no
+    str.extract equivalent, which yields NaN instead.
+    Returns the same dicts (same keys, same order) as clean_record.
+    """
+    if not raw_records:
+        return []
+
+    df = pd.DataFrame(raw_records)
+
+    dt = pd.to_datetime(df["datetime"], format="%m/%d/%Y, %I:%M %p")
+    cardholder_name, cardholder_last4 = zip(*map(parse_cardholder, df["cardholder"]))
+
+    # details_text has a variable structure -> per-row parse
+    details = [parse_details_text(text) for text in df["details_text"]]
+    purchase_type = [d["purchase_type"] for d in details]
+    is_vac = pd.Series([t == "V" for t in purchase_type], index=df.index)
+
+    # 'V': raw total string, 'W': sum of the wash bay lines
+    total_amount = pd.Series(
+        [
+            0.0 if d["purchase_type"] == "V"
+            else round(sum(e["wash_purchase_total"] for e in d["wash_bay_purchases"]), 2)
+            for d in details
+        ],
+        index=df.index,
+    )
+    total_amount[is_vac] = (
+        df.loc[is_vac, "total"]
+        .str.replace(r"[$,]", "", regex=True)
+        .str.strip()
+        .astype(float)
+    )
+
+    out = pd.DataFrame(
+        {
+            "transaction_id": df["transaction_id"].astype("int64"),
+            "purchase_date": dt.dt.strftime("%Y-%m-%d"),
+            "purchase_time": dt.dt.strftime("%H:%M:%S"),
+            "cardholder_name": cardholder_name,
+            "cardholder_last4": cardholder_last4,
+            "total_amount": total_amount,
+            "purchase_type": purchase_type,
+            # object dtype so None stays None instead of becoming NaN
+            "vacuum_number": pd.Series(
+                [d.get("vacuum_number") for d in details], index=df.index, dtype=object
+            ),
+            "wash_bay_purchases": pd.Series(
+                [d.get("wash_bay_purchases", []) for d in details], index=df.index, dtype=object
+            ),
+        }
+    )
+    return out.to_dict("records")
+
+
+def clean_records_parallel(raw_records: list[dict]) -> list[dict]:
+    """
+    clean_all_vectorized split across CPU cores.
+
+    Records are independent, so the batch is cut into one contiguous chunk per
+    core and the results are chained back together in the original order.
+    Small batches are cleaned in-process.
+
+    Workers are spawned, not forked: the dashboard calls this from a thread
+    of its multithreaded server, and forking a process with other threads
+    running can copy locks held by them and hang the child.
+    """
+    workers = os.cpu_count() or 1
+    if workers == 1 or len(raw_records) <= PARALLEL_CLEAN_MIN_RECORDS:
+        return clean_all_vectorized(raw_records)
+
+    chunk_size = -(-len(raw_records) // workers)  # ceil division
+    chunks = [raw_records[i:i + chunk_size] for i in range(0, len(raw_records), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+        return list(chain.from_iterable(ex.map(clean_all_vectorized, chunks)))
+
+
 # --- Incremental cleaning helpers ---
 
 def load_raw_records():
+    """Raw scraped entries, newest -> oldest (the JSONL file is oldest -> newest)."""
     if not RAW_JSON_PATH.exists():
         raise FileNotFoundError(f"{RAW_JSON_PATH} not found. Run cryptopay_scrape_data.py first.")
-    with RAW_JSON_PATH.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    # orjson parses straight from bytes, skipping the text decode step
+    with RAW_JSON_PATH.open("rb") as f:
+        records = [orjson.loads(line) for line in f if line.strip()]
+    records.reverse()
+    return records
 
 
 def load_existing_cleaned():
+    """Full cleaned history, oldest -> newest (one JSON object per line)."""
     if not CLEAN_JSON_PATH.exists():
         return []
-    with CLEAN_JSON_PATH.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    with CLEAN_JSON_PATH.open("rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
+
+
+def write_json(path: Path, records: list[dict]) -> None:
+    """Write records as a compact JSON list (only read back by the loader)."""
+    with path.open("wb") as f:
+        f.write(orjson.dumps(records))
+
+
+def write_cleaned(records: list[dict], mode: str = "ab") -> None:
+    """
+    Write cleaned records (newest -> oldest, as produced) to the NDJSON history.
+
+    Lines go out oldest -> newest, so with the default append mode new records
+    land at the end of the file and existing lines are never re-serialized.
+    mode="wb" starts a fresh history.
+    """
+    with CLEAN_JSON_PATH.open(mode) as f:
+        f.writelines(orjson.dumps(rec) + b"\n" for rec in reversed(records))
+
+
+def migrate_legacy_cleaned() -> None:
+    """One-off: convert an old cryptopay_cleaned.json list into the NDJSON history."""
+    # Parsed straight from the page cache instead of a bytes copy of the
+    # (pretty-printed, so large) file next to the parsed records
+    with LEGACY_CLEAN_JSON_PATH.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        records = orjson.loads(memoryview(mm))
+    write_cleaned(records, mode="wb")
+    write_txid_index(int(rec["transaction_id"]) for rec in records)
+    if records:
+        save_latest_cleaned_txid(int(records[0]["transaction_id"]))
+    print(f"Migrated {len(records)} cleaned records from {LEGACY_CLEAN_JSON_PATH} to {CLEAN_JSON_PATH}")
+
+
+def load_latest_cleaned_txid() -> int | None:
+    """
+    Newest transaction_id already in CLEAN_JSON_PATH, or None if nothing is cleaned yet.
+
+    Read from the LATEST_TXID_PATH sidecar so incremental runs don't have to
+    parse the whole cleaned history. Falls back to the last history line
+    for data dirs created before the sidecar existed.
+    """
+    if LATEST_TXID_PATH.exists():
+        text = LATEST_TXID_PATH.read_text(encoding="utf-8").strip()
+        if text:
+            return int(text)
+
+    existing_cleaned = load_existing_cleaned()
+    if not existing_cleaned:
+        return None
+    return int(existing_cleaned[-1]["transaction_id"])
+
+
+def save_latest_cleaned_txid(txid: int) -> None:
+    LATEST_TXID_PATH.write_text(f"{txid}\n", encoding="utf-8")
+
+
+# --- Cleaned transaction_id index ---
+# Packed, sorted int64 array of every cleaned transaction_id. Lets the
+# incremental safety net answer "already cleaned?" with a bisect over a
+# memory-mapped file instead of parsing the whole cleaned history.
+
+def write_txid_index(txids) -> None:
+    TXIDS_INDEX_PATH.write_bytes(array("q", sorted(set(txids))).tobytes())
+
+
+def add_to_txid_index(txids: list[int]) -> None:
+    """
+    Add newly cleaned ids. Transaction ids grow over time, so they normally
+    sort after everything already stored and are simply appended; otherwise
+    the whole index is re-sorted and rewritten.
+    """
+    if not txids:
+        return
+    new_ids = array("q", sorted(set(txids)))
+
+    if TXIDS_INDEX_PATH.exists():
+        size = TXIDS_INDEX_PATH.stat().st_size
+        with TXIDS_INDEX_PATH.open("r+b") as f:
+            if size:
+                f.seek(size - new_ids.itemsize)
+                last_id = array("q", f.read(new_ids.itemsize))[0]
+            if not size or last_id < new_ids[0]:
+                f.seek(size)
+                f.write(new_ids.tobytes())
+                return
+
+        existing = array("q", TXIDS_INDEX_PATH.read_bytes())
+        write_txid_index(chain(existing, new_ids))
+    else:
+        write_txid_index(new_ids)
+
+
+@contextmanager
+def open_txid_index():
+    """
+    Yield the cleaned transaction_ids as a sorted, memory-mapped int64 sequence
+    (use with txid_in_index). Built once from the history if the index file
+    doesn't exist yet.
+    """
+    if not TXIDS_INDEX_PATH.exists():
+        write_txid_index(int(rec["transaction_id"]) for rec in load_existing_cleaned())
+
+    if TXIDS_INDEX_PATH.stat().st_size == 0:
+        yield ()
+        return
+
+    with TXIDS_INDEX_PATH.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        txids = memoryview(mm).cast("q")
+        try:
+            yield txids
+        finally:
+            txids.release()
+
+
+def txid_in_index(txids, txid: int) -> bool:
+    i = bisect_left(txids, txid)
+    return i < len(txids) and txids[i] == txid
 
 
 def clean_all():
@@ -182,15 +413,17 @@ def clean_all():
     raw_records = load_raw_records()
     print(f"Loaded {len(raw_records)} raw records. Cleaning all...")
 
-    cleaned_records = [clean_record(rec) for rec in raw_records]
+    cleaned_records = clean_records_parallel(raw_records)
 
     # Full history
-    with CLEAN_JSON_PATH.open("w", encoding="utf-8") as f:
-        json.dump(cleaned_records, f, indent=2)
+    write_cleaned(cleaned_records, mode="wb")
 
     # Delta = everything (first run)
-    with DELTA_JSON_PATH.open("w", encoding="utf-8") as f:
-        json.dump(cleaned_records, f, indent=2)
+    write_json(DELTA_JSON_PATH, cleaned_records)
+
+    write_txid_index(rec["transaction_id"] for rec in cleaned_records)
+    if cleaned_records:
+        save_latest_cleaned_txid(cleaned_records[0]["transaction_id"])
 
     print(f"Saved {len(cleaned_records)} cleaned records to {CLEAN_JSON_PATH}")
     print(f"Saved {len(cleaned_records)} new cleaned records to {DELTA_JSON_PATH}")
@@ -199,69 +432,79 @@ def clean_all():
 def incremental_clean():
     """
     Advanced mode: only clean *new* raw records that are not yet present
-    in the cleaned JSON, and write:
-      - updated full cleaned file
+    in the cleaned history, and write:
+      - new records appended to the NDJSON history
       - delta file with only newly cleaned records
 
+    The existing cleaned history is not loaded; only its newest
+    transaction_id is needed as the stopping point.
+
     Assumptions (true given your scraper logic):
-      - RAW_JSON_PATH (cryptopay_allData.json) is sorted newest -> oldest.
-      - CLEAN_JSON_PATH (cryptopay_cleaned.json) is also newest -> oldest.
+      - load_raw_records() returns newest -> oldest.
+      - CLEAN_JSON_PATH (cryptopay_cleaned.ndjson) is oldest -> newest, append-only.
       - transaction_id is globally unique.
       - The cleaner has previously processed all older transactions.
     """
-    raw_records = load_raw_records()
-    existing_cleaned = load_existing_cleaned()
+    latest_cleaned_txid = load_latest_cleaned_txid()
 
-    if not existing_cleaned:
+    if latest_cleaned_txid is None:
         print("Cleaned file exists but has no records; cleaning all raw records.")
         return clean_all()
 
-    latest_cleaned_txid = int(existing_cleaned[0]["transaction_id"])
-    known_txids = {int(rec["transaction_id"]) for rec in existing_cleaned}
+    raw_records = load_raw_records()
     new_cleaned: list[dict] = []
+    seen_txids: set[int] = set()
 
     print(f"Loaded {len(raw_records)} raw records.")
-    print(f"Loaded {len(existing_cleaned)} existing cleaned records.")
     print(f"Latest cleaned transaction_id: {latest_cleaned_txid}")
-    print(f"{len(known_txids)} distinct transaction_ids already cleaned.")
 
-    for raw in raw_records:
-        txid = int(raw["transaction_id"])
+    with open_txid_index() as known_txids:
+        for raw in raw_records:
+            txid = int(raw["transaction_id"])
 
-        # As soon as we hit the latest already-cleaned txid,
-        # we know everything after this is older and already processed.
-        if txid == latest_cleaned_txid:
-            print("Hit latest cleaned transaction_id – stopping incremental clean.")
-            break
+            # As soon as we hit the latest already-cleaned txid,
+            # we know everything after this is older and already processed.
+            if txid == latest_cleaned_txid:
+                print("Hit latest cleaned transaction_id – stopping incremental clean.")
+                break
 
-        # Safety net: if for some reason this txid is already in cleaned set, skip it.
-        if txid in known_txids:
-            continue
+            # Safety net: skip txids cleaned in an earlier run (index lookup)
+            # or repeated within this run.
+            if txid in seen_txids or txid_in_index(known_txids, txid):
+                continue
 
-        cleaned = clean_record(raw)
-        new_cleaned.append(cleaned)
-        known_txids.add(txid)
+            cleaned = clean_record(raw)
+            new_cleaned.append(cleaned)
+            seen_txids.add(txid)
 
     if not new_cleaned:
         print("No new records to clean.")
         # still write an empty delta so loader knows there's nothing to do
-        with DELTA_JSON_PATH.open("w", encoding="utf-8") as f:
-            json.dump([], f)
+        write_json(DELTA_JSON_PATH, [])
         return
 
-    # Newest first: new cleaned records + existing cleaned history
-    all_cleaned = new_cleaned + existing_cleaned
+    print(f"Cleaned {len(new_cleaned)} new records.")
+    save_new_cleaned(new_cleaned)
 
-    # Full history
-    with CLEAN_JSON_PATH.open("w", encoding="utf-8") as f:
-        json.dump(all_cleaned, f, indent=2)
+
+def save_new_cleaned(new_cleaned: list[dict]) -> None:
+    """
+    Persist one run's newly cleaned records (newest -> oldest):
+      - appended to the NDJSON history (existing lines untouched)
+      - added to the transaction_id index
+      - written as the delta file
+      - newest transaction_id stored as the incremental cursor
+    """
+    write_cleaned(new_cleaned)
+    add_to_txid_index([rec["transaction_id"] for rec in new_cleaned])
 
     # Delta file = only the new cleaned records from this run
-    with DELTA_JSON_PATH.open("w", encoding="utf-8") as f:
-        json.dump(new_cleaned, f, indent=2)
+    write_json(DELTA_JSON_PATH, new_cleaned)
 
-    print(f"Cleaned {len(new_cleaned)} new records.")
-    print(f"Saved {len(all_cleaned)} total cleaned records to {CLEAN_JSON_PATH}")
+    if new_cleaned:
+        save_latest_cleaned_txid(new_cleaned[0]["transaction_id"])
+
+    print(f"Appended {len(new_cleaned)} new cleaned records to {CLEAN_JSON_PATH}")
     print(f"Saved {len(new_cleaned)} new cleaned records to {DELTA_JSON_PATH}")
 
 
@@ -269,6 +512,11 @@ def main():
     if not RAW_JSON_PATH.exists():
         raise FileNotFoundError(f"{RAW_JSON_PATH} not found. Run cryptopay_scrape_data.py first.")
 
+    if not CLEAN_JSON_PATH.exists() and LEGACY_CLEAN_JSON_PATH.exists():
+        # Data dir from before the NDJSON history: convert instead of re-cleaning,
+        # otherwise the delta would hold rows the DB already has
+        migrate_legacy_cleaned()
+
     if not CLEAN_JSON_PATH.exists():
         # First time: clean everything, delta = all
         clean_all()
@@ -1,10 +1,14 @@
 # backend/scripts/cryptopay_scrape_data.py
 
+from playwright.async_api import async_playwright
 from playwright.sync_api import sync_playwright
-import json
+import asyncio
+import orjson
 import os
 from pathlib import Path
 
+from app.db import get_connection, init_db
+
 PURCHASES_URL = "https://www.mycryptopay.com/login/index.php?page=purchases"
 
 # Resolve paths relative to this file (backend/scripts/...)
@@ -13,58 +17,85 @@ DATA_DIR = BASE_DIR / "data"
 DATA_DIR.mkdir(exist_ok=True)
 
 STATE_FILE = str(DATA_DIR / "cryptopay_state.json")
-OUTPUT_FILE = str(DATA_DIR / "cryptopay_allData.json")
+OUTPUT_FILE = str(DATA_DIR / "cryptopay_allData.jsonl")  # raw history, one entry per line, oldest -> newest
+LEGACY_OUTPUT_FILE = str(DATA_DIR / "cryptopay_allData.json")  # pre-JSONL raw history (JSON list, newest -> oldest)
+
+# Newest existing entries checked by the duplicate safety net (see recent_txids)
+KNOWN_TXIDS_WINDOW = 200
+
+# Browser contexts used in parallel by the full scrape (1 = one page at a time)
+SCRAPE_WORKERS = 4
+
+# Static assets the scraper never reads; requests for them are aborted so page
+# loads don't wait on images or fonts. Stylesheets are NOT blocked: innerText
+# depends on the layout (hidden elements, line/tab breaks), and
+# parse_details_text relies on the details text it produces with the site's CSS.
+BLOCKED_ASSETS = "**/*.{png,jpg,jpeg,gif,svg,ico,webp,woff,woff2,ttf,otf}"
+
+
+# Pager lookup shared by get_max_page and get_max_page_async:
+# look at the 'Page: 1, 2, 3 ... N' area and return the largest page number
+MAX_PAGE_JS = """
+    () => {
+      const ps = Array.from(document.querySelectorAll("p"))
+        .filter(p => /Page:/i.test(p.textContent));
+      if (!ps.length) return 1;
+      const pager = ps[ps.length - 1];
+      const spans = Array.from(pager.querySelectorAll("span"));
+      let maxNum = 1;
+      for (const s of spans) {
+        const t = s.textContent.trim();
+        const n = parseInt(t, 10);
+        if (!Number.isNaN(n) && n > maxNum) maxNum = n;
+      }
+      return maxNum;
+    }
+    """
 
 
 def get_max_page(page) -> int:
-    # """
-    # Look at the 'Page: 1, 2, 3 ... N' area and return the largest page number.
-    # """
-    # max_page = page.evaluate(
-    #     """
-    #     () => {
-    #       const ps = Array.from(document.querySelectorAll("p"))
-    #         .filter(p => /Page:/i.test(p.textContent));
-    #       if (!ps.length) return 1;
-    #       const pager = ps[ps.length - 1];
-    #       const spans = Array.from(pager.querySelectorAll("span"));
-    #       let maxNum = 1;
-    #       for (const s of spans) {
-    #         const t = s.textContent.trim();
-    #         const n = parseInt(t, 10);
-    #         if (!Number.isNaN(n) && n > maxNum) maxNum = n;
-    #       }
-    #       return maxNum;
-    #     }
-    #     """
-    # )
+    # max_page = page.evaluate(MAX_PAGE_JS)
     return int(2) #int(max_page or 1)
     # For testing only, you can temporarily do:
     # return 2
 
 
-def scrape_page(page, page_num: int, latest_txid: str | None = None):
-    """
-    Use the site's own JS functions to switch to page `page_num`,
-    then scrape that page's purchases and return:
-      { "data": [...entries...], "hitLatest": bool }
+async def get_max_page_async(page) -> int:
+    """Same as get_max_page, for a playwright.async_api page."""
+    # max_page = await page.evaluate(MAX_PAGE_JS)
+    return int(2) #int(max_page or 1)
 
-    If latest_txid is provided, the browser JS will, for each row:
-      - expand it
-      - extract transactionId
-      - as soon as it sees transactionId == latest_txid,
-        it stops scraping further rows and returns what it has.
-    """
-    return page.evaluate(
-        """
+
+# In-page scraper shared by scrape_page and scrape_page_async
+SCRAPE_PAGE_JS = """
     async ({ pageNum, latestTxId }) => {
-      const sleep = (ms) => new Promise(res => setTimeout(res, ms));
+      // Compiled once per page, reused for every row and every DOM change
+      const TXID_RE = /Transaction ID[:\\s]+(\\d+)/i;
+      const DETAILS_SEL = "div[id^='transaction_pos_']";
+
+      const lastTable = () => {
+        const t = document.querySelectorAll("table.purchases-table");
+        return t.length ? t[t.length - 1] : null;
+      };
 
       // Switch the internal 'pagenum' and reload purchases_inner, just like the span onclick
       if (typeof setAdditionalVar === "function" && typeof selectTab === "function") {
+        const oldTable = lastTable();
         setAdditionalVar("pagenum", String(pageNum));
         selectTab("purchases_inner");
-        await sleep(2000);  // give the table time to refresh
+
+        // Wait until a new table with rows replaces (or is appended after) the old one,
+        // checking every animation frame; give up after 5s like the old fixed sleep did
+        await new Promise((resolve) => {
+          const deadline = Date.now() + 5000;
+          const tick = () => {
+            const t = lastTable();
+            const ready = t && t !== oldTable && t.querySelector("td.purchase-transaction");
+            if (ready || Date.now() > deadline) return resolve();
+            requestAnimationFrame(tick);
+          };
+          tick();
+        });
       }
 
       // There may be multiple purchases tables if the site appends instead of replacing.
@@ -77,9 +108,20 @@ def scrape_page(page, page_num: int, latest_txid: str | None = None):
         purchasesTable.querySelectorAll("td.purchase-transaction")
       );
 
-      const allData = [];
-      let hitLatest = false;
-
+      // The details div for a row: inside the same cell, or in the next <tr>
+      // (very common expandable-row pattern)
+      const findDetails = (cell) => {
+        const detailsDiv = cell.querySelector(DETAILS_SEL);
+        if (detailsDiv) return detailsDiv;
+        const tr = cell.closest("tr");
+        return tr && tr.nextElementSibling
+          ? tr.nextElementSibling.querySelector(DETAILS_SEL)
+          : null;
+      };
+
+      // Read the row's summary cells and CLICK every row up front, so all the
+      // dropdowns load in parallel instead of one row after another
+      const rows = [];
       for (const cell of cells) {
         const innerTable = cell.querySelector("table");
         if (!innerTable) continue;
@@ -90,81 +132,96 @@ def scrape_page(page, page_num: int, latest_txid: str | None = None):
         const tds = row.querySelectorAll("td");
         if (tds.length < 4) continue;
 
-        const dateTime   = tds[0].innerText.trim();
-        const cardholder = tds[1].innerText.trim();
-        const type       = tds[2].innerText.trim();
-        const totalStr   = tds[3].innerText.trim();
+        rows.push({
+          cell,
+          dateTime:      tds[0].innerText.trim(),
+          cardholder:    tds[1].innerText.trim(),
+          totalStr:      tds[3].innerText.trim(),
+          detailsText:   "",
+          transactionId: "",
+        });
 
-        // CLICK row to load dropdown
         innerTable.scrollIntoView({ block: "center" });
         innerTable.click();
+      }
 
-        let detailsText = "";
-        let detailRows = [];
-        let transactionId = "";
-
-        // Keep polling until we see a non-empty Transaction ID or hit max attempts
-        // Slightly shorter window than before: 10 * 250ms = 2.5s max
-        for (let attempt = 0; attempt < 10 && !transactionId; attempt++) {
-          await sleep(250);
-
-          // 1) Try inside same cell
-          let detailsDiv = cell.querySelector("div[id^='transaction_pos_']");
-
-          // 2) If not found, try next <tr> sibling (very common expandable-row pattern)
-          if (!detailsDiv) {
-            const tr = cell.closest("tr");
-            if (tr && tr.nextElementSibling) {
-              const nextTr = tr.nextElementSibling;
-              const candidate = nextTr.querySelector("div[id^='transaction_pos_']");
-              if (candidate) {
-                detailsDiv = candidate;
-              }
+      // Index of the row holding latestTxId once it has loaded; rows after it
+      // are older and already known, so they aren't waited for
+      let stopAt = rows.length;
+
+      // One MutationObserver re-checks the rows still waiting whenever the DOM
+      // changes, until every needed row has a Transaction ID or time runs out.
+      // The timeout restarts each time a row resolves, so every row gets the
+      // old serial poll's 2.5s (10 x 250ms) even if the site answers the
+      // detail requests one at a time; it only fires once nothing has
+      // resolved for ROW_TIMEOUT_MS.
+      const ROW_TIMEOUT_MS = 2500;
+      await new Promise((resolve) => {
+        let observer = null;
+        let timer = null;
+        const finish = () => {
+          if (observer) observer.disconnect();
+          clearTimeout(timer);
+          resolve();
+        };
+
+        // Rows before firstPending all have their Transaction ID already
+        let firstPending = 0;
+
+        const check = () => {
+          for (let i = firstPending; i < stopAt; i++) {
+            const r = rows[i];
+            if (r.transactionId) continue;
+
+            const detailsDiv = findDetails(r.cell);
+            if (!detailsDiv) continue;  // nothing visible yet, keep waiting
+
+            const detailsTable = detailsDiv.querySelector("table");
+            const text = (detailsTable ? detailsTable.innerText : detailsDiv.innerText || "").trim();
+            if (!text) continue;  // still loading / empty
+
+            r.detailsText = text;
+            const m = TXID_RE.exec(text);
+            if (m) {
+              r.transactionId = m[1];
+              if (latestTxId && r.transactionId === latestTxId) stopAt = i;
+              clearTimeout(timer);
+              timer = setTimeout(finish, ROW_TIMEOUT_MS);
             }
           }
+          while (firstPending < stopAt && rows[firstPending].transactionId) firstPending++;
+          if (firstPending >= stopAt) finish();
+        };
 
-          if (!detailsDiv) {
-            continue;  // nothing visible yet, keep waiting
-          }
-
-          const detailsTable = detailsDiv.querySelector("table");
-          const text = (detailsTable ? detailsTable.innerText : detailsDiv.innerText || "").trim();
-          if (!text) {
-            continue;  // still loading / empty
-          }
-
-          detailsText = text;
-
-          if (detailsTable) {
-            detailRows = Array.from(detailsTable.rows).map(r =>
-              Array.from(r.cells).map(td => td.innerText.trim())
-            );
-          }
+        observer = new MutationObserver(check);
+        observer.observe(purchasesTable.ownerDocument.body, {
+          childList: true, subtree: true, characterData: true, attributes: true,
+        });
+        timer = setTimeout(finish, ROW_TIMEOUT_MS);
+        check();
+      });
 
-          const m = text.match(/Transaction ID[:\\s]+(\\d+)/i);
-          if (m) {
-            transactionId = m[1];
-            break;
-          }
-        }
+      const allData = [];
+      let hitLatest = false;
 
+      for (const r of rows) {
         // Optional debug if we *never* saw a transactionId (ideally shouldn't happen)
-        if (!transactionId) {
-          console.log("WARN: No transaction ID found for row with datetime:", dateTime, "cardholder:", cardholder);
+        if (!r.transactionId) {
+          console.log("WARN: No transaction ID found for row with datetime:", r.dateTime, "cardholder:", r.cardholder);
         }
 
         allData.push({
-          "datetime": dateTime,
-          "cardholder": cardholder,
-          "total": totalStr,
-          "transaction_id": transactionId,
-          "details_text": detailsText,
+          "datetime": r.dateTime,
+          "cardholder": r.cardholder,
+          "total": r.totalStr,
+          "transaction_id": r.transactionId,
+          "details_text": r.detailsText,
         });
 
         // Compare-as-we-scrape:
         // If this row's transactionId matches the latest known txid,
         // stop scraping the rest of the rows on this page.
-        if (latestTxId && transactionId === latestTxId) {
+        if (latestTxId && r.transactionId === latestTxId) {
           hitLatest = true;
           break;
         }
@@ -172,149 +229,356 @@ def scrape_page(page, page_num: int, latest_txid: str | None = None):
 
       return { data: allData, hitLatest };
     }
-    """,
+    """
+
+
+def open_purchases_page(context):
+    """
+    Open PURCHASES_URL in a new tab of context and wait only for the
+    purchases table instead of "networkidle" (which also waits out every
+    asset and a 500ms quiet period).
+    """
+    context.route(BLOCKED_ASSETS, lambda route: route.abort())
+    page = context.new_page()
+    page.goto(PURCHASES_URL, wait_until="domcontentloaded")
+    page.wait_for_selector("table.purchases-table")
+    return page
+
+
+async def open_purchases_page_async(context):
+    """Same as open_purchases_page, for a playwright.async_api context."""
+    async def abort(route):
+        await route.abort()
+
+    await context.route(BLOCKED_ASSETS, abort)
+    page = await context.new_page()
+    await page.goto(PURCHASES_URL, wait_until="domcontentloaded")
+    await page.wait_for_selector("table.purchases-table")
+    return page
+
+
+def scrape_page(page, page_num: int, latest_txid: str | None = None):
+    """
+    Use the site's own JS functions to switch to page `page_num`,
+    then scrape that page's purchases and return:
+      { "data": [...entries...], "hitLatest": bool }
+
+    The browser JS expands every row at once and waits for all the dropdowns
+    together, then extracts each row's transactionId.
+
+    If latest_txid is provided, rows after the one with that transactionId
+    are not waited for and the result stops at it.
+    """
+    return page.evaluate(
+        SCRAPE_PAGE_JS,
         {"pageNum": page_num, "latestTxId": latest_txid},
     )
 
 
-def load_existing_entries():
+async def scrape_page_async(page, page_num: int, latest_txid: str | None = None):
+    """Same as scrape_page, for a playwright.async_api page."""
+    return await page.evaluate(
+        SCRAPE_PAGE_JS,
+        {"pageNum": page_num, "latestTxId": latest_txid},
+    )
+
+
+def iter_entries_newest_first(block_size: int = 1 << 16):
+    """
+    Raw entries newest -> oldest, read backwards from the end of OUTPUT_FILE
+    one block at a time. The file is append-only (oldest -> newest), so the
+    newest entries are its last lines and only the lines actually consumed
+    get parsed.
+    """
+    with open(OUTPUT_FILE, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        partial = b""  # start of the line that continues into the next block
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + partial).split(b"\n")
+            partial = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield orjson.loads(line)
+        if partial.strip():
+            yield orjson.loads(partial)
+
+
+def load_recent_entries(latest_txid: str | None) -> list[dict]:
+    """
+    The newest raw entries (newest -> oldest) an incremental scrape needs:
+    everything newer than latest_txid plus KNOWN_TXIDS_WINDOW more (the same
+    cut recent_txids makes), without parsing the rest of the history.
+    With latest_txid=None that is the newest KNOWN_TXIDS_WINDOW entries.
+    """
+    migrate_legacy_entries()
     if not os.path.exists(OUTPUT_FILE):
         return []
-    with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+
+    entries = []
+    past_boundary = latest_txid is None
+    for entry in iter_entries_newest_first():
+        if past_boundary and len(entries) >= KNOWN_TXIDS_WINDOW:
+            break
+        entries.append(entry)
+        if entry_txid(entry) == latest_txid:
+            past_boundary = True
+    return entries
 
 
-def make_key(entry):
+def save_entries(entries, mode: str = "wb"):
     """
-    Unique-ish key for an entry (for incremental dedupe).
+    Write raw entries (newest -> oldest, as scraped) to OUTPUT_FILE.
+
+    Lines go out oldest -> newest, so mode="ab" adds new entries at the end
+    of the file without re-serializing the existing history; the default
+    "wb" writes a fresh history.
+
+    A fresh history goes to a .tmp file that then replaces OUTPUT_FILE, so a
+    crash mid-write can't leave a truncated history behind. (Appending never
+    touches the existing lines.)
     """
-    txid = (entry.get("transaction_id") or "").strip()
-    dt = (entry.get("datetime") or "").strip()
-    cardholder = (entry.get("cardholder") or "").strip()
-    total = (entry.get("total") or "").strip()
-    return (txid, dt, cardholder, total)
+    path = OUTPUT_FILE + ".tmp" if mode == "wb" else OUTPUT_FILE
+    # Binary write: orjson already produces UTF-8 bytes
+    with open(path, mode) as f:
+        f.writelines(orjson.dumps(entry) + b"\n" for entry in reversed(entries))
+    if path != OUTPUT_FILE:
+        os.replace(path, OUTPUT_FILE)
 
 
-def scrape_all_data():
+def append_entries(new_entries):
+    """Append one run's new entries (newest -> oldest) to the raw history."""
+    save_entries(new_entries, mode="ab")
+
+
+def migrate_legacy_entries() -> None:
+    """One-off: convert an old cryptopay_allData.json list into the JSONL history."""
+    if os.path.exists(OUTPUT_FILE) or not os.path.exists(LEGACY_OUTPUT_FILE):
+        return
+    with open(LEGACY_OUTPUT_FILE, "rb") as f:
+        entries = orjson.loads(f.read())
+    save_entries(entries)
+    print(f"Migrated {len(entries)} raw entries from {LEGACY_OUTPUT_FILE} to {OUTPUT_FILE}")
+
+
+def latest_known_txid() -> str | None:
     """
-    Full scrape: go through every page and return all entries.
-    Use this on first run when no JSON exists yet.
+    Newest transaction_id already loaded into the DB, or None if it is empty.
+
+    transaction_id is the INTEGER PRIMARY KEY, so MAX() is a single b-tree
+    lookup instead of reading the raw JSON file.
+    """
+    init_db()
+    with get_connection() as conn:
+        (txid,) = conn.execute("SELECT MAX(transaction_id) FROM Purchase").fetchone()
+    return None if txid is None else str(txid)
+
+
+def entry_txid(entry) -> str:
+    """An entry's transaction_id as scraped ("" if the row had none)."""
+    return (entry.get("transaction_id") or "").strip()
+
+
+def recent_txids(existing_entries, latest_txid: str | None) -> set[str]:
+    """
+    transaction_ids of the existing entries a fresh scrape could run into again.
+
+    Pages come newest -> oldest and stop at latest_txid, so only entries
+    newer than it (the raw file can be ahead of the DB after a failed run)
+    plus a small window of the newest ones are needed, not the whole history.
+    """
+    txids = set()
+    past_boundary = latest_txid is None
+    for i, entry in enumerate(existing_entries):
+        if past_boundary and i >= KNOWN_TXIDS_WINDOW:
+            break
+        txid = entry_txid(entry)
+        txids.add(txid)
+        if txid == latest_txid:
+            past_boundary = True
+    return txids
+
+
+def iter_pages(latest_txid: str | None = None):
+    """
+    Scrape purchases page by page (newest -> oldest) and yield each page's
+    entries as soon as that page is done, so callers can start working on
+    them while later pages are still loading.
+
+    If latest_txid is given, scraping stops at that row: it and everything
+    older are left out and no further pages are requested.
     """
     with sync_playwright() as p:
         # For debugging, you can do headless=False, slow_mo=200
         browser = p.chromium.launch(headless=True)
         context = browser.new_context(storage_state=STATE_FILE)
-        page = context.new_page()
-
-        page.goto(PURCHASES_URL, wait_until="networkidle")
+        page = open_purchases_page(context)
 
         max_page = get_max_page(page)
         print(f"Detected {max_page} pages of purchases")
 
-        all_data = []
-
         for page_num in range(1, max_page + 1):
             print(f"Scraping page {page_num}/{max_page} ...")
-            result = scrape_page(page, page_num, latest_txid=None)
+            result = scrape_page(page, page_num, latest_txid)
             page_data = result["data"]
+            # JS already stops a page early when it hits the known txid
+            hit_boundary = result["hitLatest"]
             print(f"  -> {len(page_data)} purchases on page {page_num}")
-            all_data.extend(page_data)
+
+            if latest_txid:
+                for i, entry in enumerate(page_data):
+                    txid = entry_txid(entry)
+                    if txid == latest_txid:
+                        print("Hit latest known transaction_id – stopping incremental scrape.")
+                        page_data = page_data[:i]
+                        hit_boundary = True
+                        break
+
+            yield page_data
+
+            if hit_boundary:
+                break
 
         browser.close()
-        return all_data
 
 
-def incremental_update():
+async def scrape_pages_concurrently(workers: int = SCRAPE_WORKERS):
     """
-    Incremental scrape:
-    - Load existing JSON.
-    - If it's empty, fall back to a full scrape.
-    - Otherwise:
-        - Grab latest_txid from the first existing entry.
-        - Scrape from page 1 onward, collecting new entries.
-        - As soon as the browser hits latest_txid while scraping rows,
-          it stops scraping further rows, and we stop paging.
-        - known_keys is used as a safety net against accidental duplicates.
+    Scrape every page using `workers` browser contexts at once.
+
+    Each context is built from the same saved login state and pulls the next
+    page number from a shared queue. Results are put back in page order
+    (newest -> oldest) before returning.
     """
-    existing_entries = load_existing_entries()
-    print(f"Loaded {len(existing_entries)} existing entries.")
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
 
-    # If file exists but is empty, just do a full scrape.
-    if not existing_entries:
-        print("Existing data file has no entries – running full scrape instead.")
-        return scrape_all_data()
+        async def open_page():
+            context = await browser.new_context(storage_state=STATE_FILE)
+            return await open_purchases_page_async(context)
 
-    latest_txid = (existing_entries[0].get("transaction_id") or "").strip() or None
-    print(f"Latest known transaction_id: {latest_txid!r}")
+        first_page = await open_page()
+        max_page = await get_max_page_async(first_page)
+        print(f"Detected {max_page} pages of purchases")
 
-    known_keys = {make_key(e) for e in existing_entries}
-    new_entries = []
-    hit_boundary = False
+        pages = [first_page]
+        pages += await asyncio.gather(
+            *(open_page() for _ in range(min(workers, max_page) - 1))
+        )
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(storage_state=STATE_FILE)
-        page = context.new_page()
+        page_nums: asyncio.Queue = asyncio.Queue()
+        for page_num in range(1, max_page + 1):
+            page_nums.put_nowait(page_num)
 
-        page.goto(PURCHASES_URL, wait_until="networkidle")
+        results: dict[int, list] = {}
 
-        max_page = get_max_page(page)
-        print(f"Detected {max_page} pages of purchases")
+        async def worker(page):
+            while not page_nums.empty():
+                page_num = page_nums.get_nowait()
+                print(f"Scraping page {page_num}/{max_page} ...")
+                result = await scrape_page_async(page, page_num)
+                results[page_num] = result["data"]
+                print(f"  -> {len(result['data'])} purchases on page {page_num}")
 
-        for page_num in range(1, max_page + 1):
-            if hit_boundary:
-                break
+        await asyncio.gather(*(worker(page) for page in pages))
+        await browser.close()
 
-            print(f"Scraping page {page_num}/{max_page} ...")
-            result = scrape_page(page, page_num, latest_txid)
-            page_data = result["data"]
-            page_hit_latest = result["hitLatest"]
-            print(f"  -> {len(page_data)} purchases on page {page_num}")
+    return [entry for page_num in sorted(results) for entry in results[page_num]]
+
+
+def scrape_all_data():
+    """
+    Full scrape: go through every page and return all entries.
+    Use this on first run when no JSON exists yet.
 
-            for entry in page_data:
-                txid = (entry.get("transaction_id") or "").strip()
+    Pages are scraped concurrently (see scrape_pages_concurrently); the
+    incremental scrape stays serial since it stops at the first known txid.
+    """
+    return asyncio.run(scrape_pages_concurrently())
 
-                # Safety: if we see the latest_txid here, mark boundary
-                if latest_txid and txid == latest_txid:
-                    print("Hit latest known transaction_id – stopping incremental scrape.")
-                    hit_boundary = True
-                    break
 
-                key = make_key(entry)
-                if key in known_keys:
-                    continue  # already have this one (safety net)
+def iter_new_entries(existing_entries, latest_txid: str | None = None):
+    """
+    Yield batches (one per scraped page, newest -> oldest) of entries that are
+    not in existing_entries yet.
 
-                known_keys.add(key)
-                new_entries.append(entry)
+    - Scraping stops at latest_txid; if not given it is taken from the first
+      existing entry.
+    - known_txids (see recent_txids) is a safety net against accidental
+      duplicates; transaction_id is unique, so nothing else is compared.
+    """
+    if latest_txid is None:
+        latest_txid = entry_txid(existing_entries[0]) or None
+    print(f"Latest known transaction_id: {latest_txid!r}")
 
-            if page_hit_latest:
-                # JS already stopped this page because it hit the known txid
-                hit_boundary = True
+    known_txids = recent_txids(existing_entries, latest_txid)
 
-        browser.close()
+    for page_data in iter_pages(latest_txid):
+        batch = []
+        for entry in page_data:
+            txid = entry_txid(entry)
+            # Rows whose details never loaded have no txid to compare; keep them
+            if txid and txid in known_txids:
+                continue  # already have this one (safety net)
+
+            known_txids.add(txid)
+            batch.append(entry)
+
+        if batch:
+            yield batch
+
+
+def incremental_update():
+    """
+    Incremental scrape:
+    - Load the newest existing entries (see load_recent_entries).
+    - If there are none, fall back to a full scrape (written as a fresh file).
+    - Otherwise collect everything newer than the newest transaction in the
+      DB (see iter_new_entries) and append it to OUTPUT_FILE.
+      If the DB has nothing loaded yet, the first existing entry is used.
+
+    Returns the entries written in this run (newest -> oldest).
+    """
+    # The DB boundary is an index lookup; if it lags the raw file (a run that
+    # failed before loading) known_txids drops the rows we already have.
+    latest_txid = latest_known_txid()
+
+    existing_entries = load_recent_entries(latest_txid)
+    print(f"Loaded {len(existing_entries)} most recent existing entries.")
+
+    # If file exists but is empty, just do a full scrape.
+    if not existing_entries:
+        print("Existing data file has no entries – running full scrape instead.")
+        data = scrape_all_data()
+        save_entries(data)
+        return data
+
+    new_entries = []
+    for batch in iter_new_entries(existing_entries, latest_txid):
+        new_entries.extend(batch)
 
     if new_entries:
         print(f"Found {len(new_entries)} new entries.")
-        # Newest first: freshly scraped (new → old) + existing (already new → old)
-        all_entries = new_entries + existing_entries
+        # Only the new lines are written; existing ones stay as they are
+        append_entries(new_entries)
     else:
         print("No new entries found.")
-        all_entries = existing_entries
 
-    return all_entries
+    return new_entries
 
 
 if __name__ == "__main__":
     # If we've never scraped before, do a full scrape.
-    # Otherwise, only scrape new stuff and merge.
+    # Otherwise, only scrape new stuff and append it.
+    migrate_legacy_entries()
     if not os.path.exists(OUTPUT_FILE):
         print("No existing data file found – doing full initial scrape...")
         data = scrape_all_data()
+        save_entries(data)
+        print(f"Saved {len(data)} purchases to {OUTPUT_FILE}")
     else:
         print("Existing data file found – doing incremental update...")
         data = incremental_update()
-
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-    print(f"Saved {len(data)} purchases to {OUTPUT_FILE}")
+        print(f"Saved {len(data)} new purchases to {OUTPUT_FILE}")
@@ -7,33 +7,43 @@
 # This is on the company im scraping off of. Not good for them, bad for my data :(
 
 
-import json
-from collections import Counter
 from pathlib import Path
 
+import orjson
+
 BASE_DIR = Path(__file__).resolve().parents[1]  # backend/
-DATA_FILE = BASE_DIR / "data" / "cryptopay_cleaned.json"
+DATA_FILE = BASE_DIR / "data" / "cryptopay_cleaned.ndjson"  # one record per line
+
+def iter_records():
+    """Stream the cleaned records one line at a time."""
+    with DATA_FILE.open("rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
 
 def main():
     if not DATA_FILE.exists():
         print(f"Data file not found: {DATA_FILE}")
         return
 
-    with DATA_FILE.open("r", encoding="utf-8") as f:
-        records = json.load(f)
-
-    # adjust this if your key name is different
-    ids = []
-    for row in records:
+    # One streaming pass that keeps only ids, never the records themselves
+    seen = set()
+    dupes = {}  # dict as an ordered set: duplicate ids in first-seen order
+    total = 0
+    for row in iter_records():
+        total += 1
+        # adjust this if your key name is different
         tid = row.get("transaction_id")
-        if tid is not None:
-            ids.append(tid)
-
-    counter = Counter(ids)
-    dupes = [tid for tid, count in counter.items() if count > 1]
+        if tid is None:
+            continue
+        if tid in seen:
+            dupes[tid] = None
+        else:
+            seen.add(tid)
+    dupes = list(dupes)
 
-    print(f"Total records: {len(records)}")
-    print(f"Unique transaction_ids: {len(counter)}")
+    print(f"Total records: {total}")
+    print(f"Unique transaction_ids: {len(seen)}")
     print(f"Duplicate transaction_ids count: {len(dupes)}")
 
     if dupes:
@@ -41,12 +51,12 @@ def main():
         for tid in dupes[:20]:
             print(" -", tid)
 
-        # optional: show all rows with the first duplicate
+        # optional: show all rows with the first duplicate (second streaming pass)
         print("\nRows for first duplicate ID:")
         first = dupes[0]
-        for row in records:
+        for row in iter_records():
             if row.get("transaction_id") == first:
-                print(json.dumps(row, indent=2))
+                print(orjson.dumps(row, option=orjson.OPT_INDENT_2).decode())
     else:
         print("No duplicate transaction_id values found.")
 
@@ -1,205 +1,358 @@
 # backend/scripts/load_transactions.py
 
-import json
+import sqlite3
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from itertools import chain, islice
+from operator import itemgetter
 from pathlib import Path
 
+import ijson
+import orjson
+
 # From the __init__ package we made for app/ db.py is a module named db
-from app.db import get_connection, init_db
+from app.db import get_connection, init_db, loader_transaction
 
 # Paths
 ROOT_DIR = Path(__file__).resolve().parents[1]   # .../backend
 DATA_DIR = ROOT_DIR / "data"
-CLEAN_JSON_PATH = DATA_DIR / "cryptopay_cleaned.json"
+CLEAN_JSON_PATH = DATA_DIR / "cryptopay_cleaned.ndjson"  # one record per line
 DELTA_JSON_PATH = DATA_DIR / "cryptopay_cleaned_delta.json"  # <-- NEW
 
 
-def load_json(path: Path):
-    """Read a JSON file (full or delta) and return list of purchases."""
+def iter_json(path: Path):
+    """
+    Yield purchases one at a time from a JSON list file (the delta).
+
+    ijson parses incrementally, so the whole list is never held in memory.
+    use_float=True gives floats (not Decimal) for amounts, which sqlite3 can bind.
+    """
     if not path.exists():
         raise FileNotFoundError(f"{path} not found.")
-    # with ensures __enter__ and __exit__ are called properly. exit is called reguardless if it exists normally or with an exception.
-    # bascially it closes the file automatically for us. handles clean up. otherwise use a try and catch block. this is just cleaner.
-    with path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
+    with path.open("rb") as f:
+        if f.read(64).lstrip()[:1] != b"[":
+            raise ValueError(f"Expected top-level JSON list in {path.name}")
+        f.seek(0)
+        yield from ijson.items(f, "item", use_float=True)
 
-    if not isinstance(data, list):
-        raise ValueError(f"Expected top-level JSON list in {path.name}")
 
-    return data
+def iter_ndjson(path: Path):
+    """Yield purchases one at a time from the NDJSON cleaned history (one per line)."""
+    if not path.exists():
+        raise FileNotFoundError(f"{path} not found.")
+    with path.open("rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
 
 
-def get_purchase_count() -> int:
-    
+def purchases_empty(conn: sqlite3.Connection | None = None) -> bool:
     """
-    Return how many rows exist in the Purchase table.
+    True if the Purchase table has no rows.
     If the DB file is new, init_db() will create tables first.
-    """
-    init_db()
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM Purchase")
-        (count,) = cur.fetchone()
-    return int(count)
 
+    If conn is given it is used as-is (the caller already ran init_db()
+    and owns the transaction); otherwise a connection is opened here.
 
-def build_rows(purchases):
+    EXISTS stops at the first row it finds, while COUNT(*) walks the whole
+    table; the full-vs-delta decision only needs to know whether it is empty.
     """
-    Convert list of purchase dicts into rows for executemany.
+    if conn is None:
+        init_db()
+        with get_connection() as conn:
+            return purchases_empty(conn)
 
-    JSON shape:
+    (has_rows,) = conn.execute("SELECT EXISTS (SELECT 1 FROM Purchase)").fetchone()
+    return not has_rows
 
-    {
-      "transaction_id": 2085361712,
-      "purchase_date": "2025-11-26",
-      "purchase_time": "22:31:00",
-      "cardholder_name": "EMV-TAP",
-      "cardholder_last4": "0420",
-      "total_amount": 3.75,
-      "purchase_type": "W" or "V",
-      "vacuum_number": null or int,
-      "wash_bay_purchases": [
-        { "bay_number": 5, "wash_purchase_total": 3.75 },
-        ...
-      ]
-    }
-    """
 
-    purchase_rows = []
-    vacuum_rows = []
-    wash_bay_rows = []
+# Purchases are consumed from the (streamed) input this many at a time;
+# their rows go straight from the generators below into the INSERTs.
+PURCHASE_BATCH_SIZE = 10_000
 
-    for p in purchases:
-        transaction_id = int(p["transaction_id"])
-        purchase_date = p["purchase_date"]          # already 'YYYY-MM-DD'
-        purchase_time = p["purchase_time"]          # already 'HH:MM:SS'
-        cardholder_name = p.get("cardholder_name")
-        cardholder_last4 = p.get("cardholder_last4")
-        total_amount = float(p["total_amount"])
-        purchase_type = p["purchase_type"]          # 'V' or 'W'
-
-        # ---- Parent row for Purchase table ----
-        purchase_rows.append(
-            (
-                transaction_id,
-                purchase_date,
-                purchase_time,
-                cardholder_name,
-                cardholder_last4,
-                total_amount,
-                purchase_type,
-            )
+
+def chunked(iterable, n: int):
+    """Yield lists of up to n items from iterable, reading it only once."""
+    it = iter(iterable)
+    while True:
+        buf = list(islice(it, n))
+        if not buf:
+            return
+        yield buf
+
+
+# SQLite's default cap on bound parameters per statement (builds before 3.32)
+SQLITE_MAX_PARAMS = 999
+
+
+def existing_txids(cur: sqlite3.Cursor, txids: list[int]) -> set[int]:
+    """The given transaction_ids that are already in Purchase (primary-key lookups)."""
+    found = set()
+    for ids in chunked(txids, SQLITE_MAX_PARAMS):
+        placeholders = ",".join("?" * len(ids))
+        cur.execute(
+            f"SELECT transaction_id FROM Purchase WHERE transaction_id IN ({placeholders})",
+            ids,
         )
+        found.update(row[0] for row in cur)
+    return found
 
-        # ---- Child rows based on purchase_type ----
-        if purchase_type == "V":
-            # Vacuum purchase: one row in VacuumPurchase
-            vacuum_number = p["vacuum_number"]
-            if vacuum_number is None:
-                # Safety – DB column is NOT NULL
-                raise ValueError(
-                    f"Vacuum purchase with null vacuum_number (tx {transaction_id})"
-                )
-            vacuum_rows.append((transaction_id, int(vacuum_number)))
 
+def drop_known_purchases(
+    cur: sqlite3.Cursor, batch: list[dict], seen: set[int] | None = None
+) -> list[dict]:
+    """
+    Remove purchases whose transaction_id is already in the DB or repeated in
+    the batch. A re-run or a duplicated source row is then skipped instead
+    of failing the whole transaction on the primary key, and no child rows
+    are added twice.
+
+    seen is for loads that started on an empty table: it holds every
+    transaction_id inserted so far (and is updated here), so the DB doesn't
+    have to be queried at all.
+    """
+    if seen is None:
+        known = existing_txids(cur, [p["transaction_id"] for p in batch])
+    else:
+        known = seen
+    new_purchases = []
+    for p in batch:
+        txid = p["transaction_id"]
+        if txid in known:
+            continue
+        known.add(txid)
+        new_purchases.append(p)
+    return new_purchases
+
+
+# Inserted columns per table, in the order iter_table_rows yields them
+TABLE_COLUMNS = {
+    "Purchase": (
+        "transaction_id",
+        "purchase_date",
+        "purchase_time",
+        "cardholder_name",
+        "cardholder_last4",
+        "total_amount",
+        "purchase_type",
+    ),
+    "VacuumPurchase": ("transaction_id", "vacuum_number"),
+    "WashBayPurchase": ("transaction_id", "bay_number", "wash_purchase_total"),
+}
+
+
+@lru_cache(maxsize=None)
+def multi_insert_sql(table: str, n_rows: int) -> str:
+    """
+    INSERT INTO table (columns) VALUES (?, ...), (?, ...), ... for n_rows rows.
+
+    Cached: a load only ever needs the full-statement size and a few
+    remainder sizes per table, so each statement text is built once.
+    """
+    columns = TABLE_COLUMNS[table]
+    row = "(" + ", ".join("?" * len(columns)) + ")"
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([row] * n_rows)
+
+
+# Rows per multi-row INSERT for each table: as many as fit in SQLITE_MAX_PARAMS
+# (142 Purchase, 499 VacuumPurchase, 333 WashBayPurchase). One statement runs a
+# single VDBE program for all of them instead of one step per row.
+ROWS_PER_INSERT = {
+    table: SQLITE_MAX_PARAMS // len(columns) for table, columns in TABLE_COLUMNS.items()
+}
+
+
+# iter_table_rows turns purchase dicts into (table, parameter tuple) pairs for
+# all three tables in one pass; insert_all buffers them per table.
+# Validation is left to the schema: the CHECK on Purchase.purchase_type and
+# the NOT NULL columns make the INSERT raise sqlite3.IntegrityError on a bad
+# record, which rolls back the load like the old ValueErrors did.
+#
+# JSON shape:
+#
+# {
+#   "transaction_id": 2085361712,
+#   "purchase_date": "2025-11-26",
+#   "purchase_time": "22:31:00",
+#   "cardholder_name": "EMV-TAP",
+#   "cardholder_last4": "0420",
+#   "total_amount": 3.75,
+#   "purchase_type": "W" or "V",
+#   "vacuum_number": null or int,
+#   "wash_bay_purchases": [
+#     { "bay_number": 5, "wash_purchase_total": 3.75 },
+#     ...
+#   ]
+# }
+
+# Built once: each call returns the Purchase row tuple straight from the
+# record in C, instead of one subscript per field plus building the tuple in
+# Python. The values need no conversion: cleaned records already hold int ids
+# and float amounts (clean_record, the pandas path and ijson with use_float).
+_purchase_row = itemgetter(*TABLE_COLUMNS["Purchase"])   # dates already 'YYYY-MM-DD' / 'HH:MM:SS'
+
+
+def iter_table_rows(purchases):
+    """
+    Yield (table, row) for every row the purchases produce:
+      - one Purchase row each (the parent)
+      - Vacuum purchase: one row in VacuumPurchase
+      - Wash purchase: 0..N rows in WashBayPurchase
+    """
+    for p in purchases:
+        row = _purchase_row(p)
+        yield "Purchase", row
+
+        transaction_id = row[0]
+        purchase_type = row[-1]                     # 'V' or 'W'
+
+        if purchase_type == "V":
+            # A missing number stays None and NOT NULL rejects it
+            yield "VacuumPurchase", (transaction_id, p["vacuum_number"])
         elif purchase_type == "W":
-            # Wash purchase: 0..N rows in WashBayPurchase
             for line in p.get("wash_bay_purchases", []):
-                bay_number = int(line["bay_number"])
-                wash_total = float(line["wash_purchase_total"])
-                wash_bay_rows.append(
-                    (transaction_id, bay_number, wash_total)
+                yield "WashBayPurchase", (
+                    transaction_id,
+                    line["bay_number"],
+                    line["wash_purchase_total"],
                 )
 
-        else:
-            raise ValueError(f"Unknown purchase_type: {purchase_type!r}")
 
-    return purchase_rows, vacuum_rows, wash_bay_rows
+def insert_all(
+    purchases, conn: sqlite3.Connection | None = None, into_empty: bool = False
+) -> tuple[int, int, int]:
+    """
+    Insert purchases (any iterable, e.g. a streamed file) into the database.
+
+    The input is read once, PURCHASE_BATCH_SIZE purchases at a time. Each
+    batch goes through iter_table_rows in a single pass; rows are buffered
+    per table and written with a multi-row INSERT whenever a buffer holds
+    ROWS_PER_INSERT rows. Purchases that are already in the DB are skipped
+    (see drop_known_purchases).
+    Returns (purchase_rows, vacuum_rows, wash_bay_rows) inserted.
+
+    into_empty=True when Purchase had no rows at the start of the
+    transaction: duplicates can then only come from the input itself, so
+    they are tracked in a set instead of looked up in the DB per batch.
+
+    With conn=None a loader connection is opened here and everything runs in
+    one BEGIN IMMEDIATE ... COMMIT, rolled back on failure. When the caller
+    passes conn it owns the transaction, so nothing is committed here.
+    """
+    if conn is None:
+        with loader_transaction() as conn:
+            return insert_all(purchases, conn, into_empty)
 
+    cur = conn.cursor()
+    seen = set() if into_empty else None
+    pending = {table: [] for table in TABLE_COLUMNS}
+    counts = dict.fromkeys(TABLE_COLUMNS, 0)
 
-def insert_all(purchase_rows, vacuum_rows, wash_bay_rows):
-    """Insert all rows into the database using executemany."""
-    # Make sure tables exist
-    init_db()
+    def flush(table: str) -> None:
+        rows = pending[table]
+        cur.execute(multi_insert_sql(table, len(rows)), list(chain.from_iterable(rows)))
+        counts[table] += cur.rowcount
+        rows.clear()
 
-    with get_connection() as conn:
-        cur = conn.cursor()
+    for batch in chunked(purchases, PURCHASE_BATCH_SIZE):
+        for table, row in iter_table_rows(drop_known_purchases(cur, batch, seen)):
+            rows = pending[table]
+            rows.append(row)
+            if len(rows) == ROWS_PER_INSERT[table]:
+                flush(table)
 
-        # --- Purchase table ---
-        if purchase_rows:
-            cur.executemany(
-                """
-                INSERT INTO Purchase (
-                    transaction_id,
-                    purchase_date,
-                    purchase_time,
-                    cardholder_name,
-                    cardholder_last4,
-                    total_amount,
-                    purchase_type
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                purchase_rows,
-            )
-
-        # --- VacuumPurchase table ---
-        if vacuum_rows:
-            cur.executemany(
-                """
-                INSERT INTO VacuumPurchase (
-                    transaction_id,
-                    vacuum_number
-                ) VALUES (?, ?)
-                """,
-                vacuum_rows,
-            )
-
-        # --- WashBayPurchase table ---
-        if wash_bay_rows:
-            cur.executemany(
-                """
-                INSERT INTO WashBayPurchase (
-                    transaction_id,
-                    bay_number,
-                    wash_purchase_total
-                ) VALUES (?, ?, ?)
-                """,
-                wash_bay_rows,
-            )
+        # Empty the buffers before the next batch's duplicate check, which
+        # only sees rows that are already in the DB
+        for table, rows in pending.items():
+            if rows:
+                flush(table)
 
-        conn.commit()
+    return counts["Purchase"], counts["VacuumPurchase"], counts["WashBayPurchase"]
 
 
-def main():
+# Tables filled by insert_all; their secondary indexes are deferred on a full load
+LOADED_TABLES = ("Purchase", "VacuumPurchase", "WashBayPurchase")
+
+
+@contextmanager
+def deferred_indexes(conn: sqlite3.Connection):
+    """
+    Drop the secondary indexes on LOADED_TABLES for the duration of the block
+    and recreate them afterwards, so a bulk load builds each index once
+    instead of updating it for every inserted row. The tables are then
+    ANALYZEd, so the query planner has statistics for the freshly loaded data.
+
+    Primary keys are left alone (their indexes have no sql in sqlite_master).
+    Must run inside the caller's transaction: if the block raises, the
+    rollback brings the dropped indexes back.
+    """
+    indexes = conn.execute(
+        f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL
+          AND tbl_name IN ({",".join("?" * len(LOADED_TABLES))})
+        """,
+        LOADED_TABLES,
+    ).fetchall()
+
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+
+    yield
+
+    for _, sql in indexes:
+        conn.execute(sql)
+    for table in LOADED_TABLES:
+        conn.execute(f"ANALYZE {table}")
+
+
+def main(conn: sqlite3.Connection | None = None):
+    """
+    Load the cleaned full history or delta into SQLite.
+
+    Pass conn to run the whole load inside the caller's transaction
+    (see app/core/load_db.run_load). Otherwise one loader connection is
+    opened here and shared by the row count and the inserts.
+    """
+    if conn is None:
+        # First load into an empty DB: safe to skip fsyncs (see SQLITE_BULK_PRAGMAS)
+        bulk = purchases_empty()
+        with loader_transaction(bulk=bulk) as conn:
+            return main(conn)
+
     # 1) Check if DB has any data in Purchase
-    purchase_count = get_purchase_count()
-    print(f"Purchase table currently has {purchase_count} rows.")
+    full_load = purchases_empty(conn)
 
     # 2) Decide whether to use full cleaned file or delta
-    if purchase_count == 0:
+    if full_load:
         # Initial load / reinitialized DB: use full cleaned history
         print("Database is empty – loading full cleaned history.")
-        purchases = load_json(CLEAN_JSON_PATH)
+        purchases = iter_ndjson(CLEAN_JSON_PATH)
     else:
         # Incremental update: use delta only
+        print("Purchase table already has rows.")
         if not DELTA_JSON_PATH.exists():
             print(f"No delta file found at {DELTA_JSON_PATH}; nothing to load.")
             return
 
-        purchases = load_json(DELTA_JSON_PATH)
-        if not purchases:
+        purchases = iter_json(DELTA_JSON_PATH)
+        first = next(purchases, None)
+        if first is None:
             print("Delta file is empty – no new cleaned records to load into DB.")
             return
 
-        print(f"Loading {len(purchases)} new cleaned records from delta file.")
-
-    # 3) Build rows and insert
-    purchase_rows, vacuum_rows, wash_bay_rows = build_rows(purchases)
+        purchases = chain([first], purchases)
+        print("Loading new cleaned records from delta file.")
 
-    print(f"Prepared {len(purchase_rows)} Purchase rows")
-    print(f"Prepared {len(vacuum_rows)} VacuumPurchase rows")
-    print(f"Prepared {len(wash_bay_rows)} WashBayPurchase rows")
+    # 3) Stream rows into the tables (a full load rebuilds the indexes once at the end)
+    with deferred_indexes(conn) if full_load else nullcontext():
+        purchase_rows, vacuum_rows, wash_bay_rows = insert_all(
+            purchases, conn, into_empty=full_load
+        )
 
-    insert_all(purchase_rows, vacuum_rows, wash_bay_rows)
+    print(f"Inserted {purchase_rows} Purchase rows")
+    print(f"Inserted {vacuum_rows} VacuumPurchase rows")
+    print(f"Inserted {wash_bay_rows} WashBayPurchase rows")
     print("Database update complete.")
 
 